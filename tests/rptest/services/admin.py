@@ -7,6 +7,7 @@
 # the Business Source License, use of this software will be governed
 # by the Apache License, Version 2.0
 import random
+import orjson
 import requests
 from ducktape.utils.util import wait_until
 
@@ -14,11 +15,24 @@ from ducktape.utils.util import wait_until
 class Admin:
     def __init__(self, redpanda):
         self.redpanda = redpanda
+        # reuse connections across requests. tests poll the admin api in tight
+        # loops, and a new connection per request dominates the latency.
+        self._session = requests.Session()
+
+    def close(self):
+        """
+        Close pooled connections held by this client.
+        """
+        self._session.close()
 
     @staticmethod
     def ready(node):
         url = f"http://{node.account.hostname}:9644/v1/status/ready"
-        return requests.get(url).json()
+        return Admin._json(requests.get(url))
+
+    @staticmethod
+    def _json(response):
+        return orjson.loads(response.content)
 
     @staticmethod
     def _url(node, path):
@@ -30,7 +44,7 @@ class Admin:
         """
         node = node or self.redpanda.controller()
         url = self._url(node, f"brokers")
-        ret = requests.get(url).json()
+        ret = self._json(self._session.get(url))
         self.redpanda.logger.debug(ret)
         return ret
 
@@ -52,7 +66,7 @@ class Admin:
         url = self._url(node, f"partitions")
         if topic:
             url = f"{url}/{namespace}/{topic}/{partition}"
-        return requests.get(url).json()
+        return self._json(self._session.get(url))
 
     def set_partition_replicas(self,
                                topic,
@@ -67,7 +81,7 @@ class Admin:
         node = node or self.redpanda.controller()
         url = self._url(
             node, f"partitions/{namespace}/{topic}/{partition}/replicas")
-        ret = requests.post(url, json=replicas)
+        ret = self._session.post(url, json=replicas)
         self.redpanda.logger.debug(ret)
         return ret
 
@@ -84,7 +98,7 @@ class Admin:
                 password=password,
                 algorithm=algorithm,
             )
-            reply = requests.post(url, json=data)
+            reply = self._session.post(url, json=data)
             self.redpanda.logger.debug(f"{reply.status_code} {reply.text}")
             return reply.status_code == 200
 
@@ -97,7 +111,7 @@ class Admin:
 
         def handle(node):
             url = f"http://{node.account.hostname}:9644/{path}"
-            reply = requests.delete(url)
+            reply = self._session.delete(url)
             return reply.status_code == 200
 
         self._send_request(handle)
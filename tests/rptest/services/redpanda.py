@@ -23,10 +23,12 @@ from ducktape.cluster.cluster import ClusterNode
 from prometheus_client.parser import text_string_to_metric_families
 
 from rptest.clients.kafka_cat import KafkaCat
+from rptest.clients.types import TopicSpec
 from rptest.services.storage import ClusterStorage, NodeStorage
 from rptest.services.admin import Admin
 from rptest.clients.python_librdkafka import PythonLibrdkafka
 from kafka import KafkaAdminClient
+from kafka.admin import NewTopic
 
 Partition = collections.namedtuple('Partition',
                                    ['index', 'leader', 'replicas'])
@@ -433,3 +435,25 @@ class RedpandaService(Service):
         client = self._client_type(self)
         self.logger.debug(f"Creating topic {spec}")
         client.create_topic(spec)
+
+    def create_topics(self, specs):
+        """
+        Create several topics with a single CreateTopics request.
+
+        Unlike create_topic, this does not go through the configured client
+        type: it always uses the service's kafka-python KafkaAdminClient so
+        that all topics are created in one request. Like KafkaCliTools, it
+        sets the topic's cleanup.policy.
+        """
+        def make_topic(spec):
+            configs = dict()
+            if spec.cleanup_policy:
+                key = TopicSpec.PROPERTY_CLEANUP_POLICY
+                configs[key] = spec.cleanup_policy
+            return NewTopic(name=spec.name,
+                            num_partitions=spec.partition_count,
+                            replication_factor=spec.replication_factor,
+                            topic_configs=configs)
+
+        self.logger.debug(f"Creating topics {[str(s) for s in specs]}")
+        self._client.create_topics([make_topic(s) for s in specs])
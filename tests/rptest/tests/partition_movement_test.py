@@ -7,9 +7,13 @@
 # the Business Source License, use of this software will be governed
 # by the Apache License, Version 2.0
 
+import collections
 import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+from ducktape.errors import TimeoutError
 from ducktape.mark.resource import cluster
 from ducktape.utils.util import wait_until
 from rptest.clients.kafka_cat import KafkaCat
@@ -20,6 +24,30 @@ from rptest.tests.redpanda_test import RedpandaTest
 from rptest.services.admin import Admin
 from kafka import KafkaProducer
 from kafka import KafkaConsumer
+from kafka import TopicPartition
+
+
+class RecordDigest:
+    """
+    Order-independent summary of a collection of (key, value) records that
+    does not retain the records themselves. Hashes are summed rather than
+    xor'd so that a duplicated record does not cancel itself out.
+    """
+    MASK = (1 << 64) - 1
+
+    def __init__(self):
+        self.count = 0
+        self.digest = 0
+
+    def add(self, record):
+        self.count += 1
+        self.digest = (self.digest + hash(record)) & self.MASK
+
+    def __eq__(self, other):
+        return self.count == other.count and self.digest == other.digest
+
+    def __str__(self):
+        return f"RecordDigest(count={self.count}, digest={self.digest:x})"
 
 
 class PartitionMovementTest(RedpandaTest):
@@ -34,14 +62,74 @@ class PartitionMovementTest(RedpandaTest):
     - Add settings for scaling up tests
     - Add tests guarnateeing multiple segments
     """
+    # number of partition moves run concurrently in test_empty
+    MOVE_WORKERS = 4
+
+    def setUp(self):
+        super(PartitionMovementTest, self).setUp()
+        # a requests.Session is not guaranteed to be thread-safe, so each thread
+        # polling the admin api gets its own Admin. see _admin.
+        self._admin_local = threading.local()
+        self._admins = []
+        self._admins_lock = threading.Lock()
+        # broker membership is fixed for the duration of a test. fetch it before
+        # any concurrent moves start so workers only ever read it.
+        self._brokers = self._admin.get_brokers()
+        self._node_idx = {
+            id(node): self.redpanda.idx(node)
+            for node in self.redpanda.nodes
+        }
+        # used to query every node's partitions concurrently while polling,
+        # from up to MOVE_WORKERS concurrent moves.
+        self._node_executor = ThreadPoolExecutor(
+            max_workers=len(self.redpanda.nodes) * self.MOVE_WORKERS)
+
+    def tearDown(self):
+        self._node_executor.shutdown()
+        for admin in self._admins:
+            admin.close()
+        super(PartitionMovementTest, self).tearDown()
+
+    @property
+    def _admin(self):
+        """
+        The calling thread's Admin client.
+        """
+        admin = getattr(self._admin_local, "admin", None)
+        if admin is None:
+            admin = Admin(self.redpanda)
+            self._admin_local.admin = admin
+            with self._admins_lock:
+                self._admins.append(admin)
+        return admin
+
+    @staticmethod
+    def _wait_fast(pred, timeout_sec=30, err_msg=""):
+        """
+        Like wait_until, but polls with a short initial backoff that doubles
+        up to a small cap. Partition moves usually complete well within a
+        second, so a fixed one second backoff mostly adds latency. Raises
+        ducktape's TimeoutError on expiry.
+        """
+        deadline = time.time() + timeout_sec
+        backoff_sec = 0.05
+        while True:
+            if pred():
+                return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError(err_msg
+                                   or "Timed out waiting for condition")
+            time.sleep(min(backoff_sec, remaining))
+            backoff_sec = min(backoff_sec * 2, 0.5)
+
     @staticmethod
     def _random_partition(metadata):
         topic = random.choice(metadata)
         partition = random.choice(topic["partitions"])
         return topic["topic"], partition["partition"]
 
-    @staticmethod
-    def _choose_replacement(admin, assignments):
+    def _choose_replacement(self, assignments):
         """
         Does not produce assignments that contain duplicate nodes. This is a
         limitation in redpanda raft implementation.
@@ -55,22 +143,26 @@ class PartitionMovementTest(RedpandaTest):
         # remove random assignment(s). we allow no changes to be made to
         # exercise the code paths responsible for dealing with no-ops.
         num_replacements = random.randint(0, replication_factor)
-        selected = random.sample(assignments, num_replacements)
-        for assignment in selected:
-            assignments.remove(assignment)
+        order = list(range(replication_factor))
+        random.shuffle(order)
+        selected = [assignments[i] for i in order[:num_replacements]]
+        keep = sorted(order[num_replacements:])
+        assignments[:] = [assignments[i] for i in keep]
 
         # choose a valid random replacement
         replacements = []
-        brokers = admin.get_brokers()
+        brokers = self._brokers
+        taken = node_ids(assignments)
         while len(assignments) != replication_factor:
             broker = random.choice(brokers)
             node_id = broker["node_id"]
-            if node_id in node_ids(assignments):
+            if node_id in taken:
                 continue
             core = random.randint(0, broker["num_cores"] - 1)
             replacement = dict(node_id=node_id, core=core)
             assignments.append(replacement)
             replacements.append(replacement)
+            taken.add(node_id)
 
         return selected, replacements
 
@@ -84,34 +176,65 @@ class PartitionMovementTest(RedpandaTest):
         return [normalize(a) for a in res["replicas"]]
 
     @staticmethod
-    def _equal_assignments(r0, r1):
-        def to_tuple(a):
-            return a["node_id"], a["core"]
-
-        r0 = [to_tuple(a) for a in r0]
-        r1 = [to_tuple(a) for a in r1]
-        return set(r0) == set(r1)
+    def _assignment_set(assignments):
+        return frozenset((a["node_id"], a["core"]) for a in assignments)
 
-    def _get_current_partitions(self, admin, topic, partition_id):
-        def keep(p):
-            return p["ns"] == "kafka" and p["topic"] == topic and p[
-                "partition_id"] == partition_id
+    def _get_current_partitions(self, topic, partition_id):
+        # the admin api has no per-node query for a single partition, so fetch
+        # each node's partition list concurrently.
+        nodes = self.redpanda.nodes
+        responses = self._node_executor.map(
+            lambda n: self._admin.get_partitions(node=n), nodes)
 
         result = []
-        for node in self.redpanda.nodes:
-            node_id = self.redpanda.idx(node)
-            partitions = admin.get_partitions(node=node)
-            partitions = filter(keep, partitions)
-            for partition in partitions:
-                result.append(dict(node_id=node_id, core=partition["core"]))
+        for node, partitions in zip(nodes, responses):
+            node_id = self._node_idx[id(node)]
+            result.extend(
+                dict(node_id=node_id, core=p["core"]) for p in partitions
+                if p["ns"] == "kafka" and p["topic"] == topic
+                and p["partition_id"] == partition_id)
         return result
 
-    def _move_and_verify(self):
-        admin = Admin(self.redpanda)
+    def _describe_topics(self, topics):
+        """
+        Return describe_topics() output for the given topics once each reports
+        all of its partitions with an elected leader. Callers cache the result
+        for picking partitions to move, so only the topic and partition ids are
+        meaningful; replicas, leader and isr go stale as partitions move.
+        """
+        counts = {spec.name: spec.partition_count for spec in topics}
+        metadata = None
+
+        def topic_ready(t):
+            if t["error_code"] != 0:
+                return False
+            if len(t["partitions"]) != counts[t["topic"]]:
+                return False
+            return all(p["leader"] != -1 for p in t["partitions"])
+
+        def complete():
+            nonlocal metadata
+            metadata = self.redpanda.describe_topics(list(counts))
+            return len(metadata) == len(counts) and all(
+                topic_ready(t) for t in metadata)
+
+        wait_until(complete,
+                   timeout_sec=30,
+                   backoff_sec=1,
+                   err_msg="Topic metadata did not become complete")
+        return metadata
+
+    def _move_and_verify(self, metadata, topic=None, partition=None):
+        """
+        Move a partition and wait for the move to complete. A random partition
+        is chosen from the metadata returned by _describe_topics() unless one
+        is given.
+        """
+        admin = self._admin
 
         # choose a random topic-partition
-        metadata = self.redpanda.describe_topics()
-        topic, partition = self._random_partition(metadata)
+        if topic is None:
+            topic, partition = self._random_partition(metadata)
         self.logger.info(f"selected topic-partition: {topic}-{partition}")
 
         # get the partition's replica set, including core assignments. the kafka
@@ -120,98 +243,207 @@ class PartitionMovementTest(RedpandaTest):
         self.logger.info(f"assignments for {topic}-{partition}: {assignments}")
 
         # build new replica set by replacing a random assignment
-        selected, replacements = self._choose_replacement(admin, assignments)
+        selected, replacements = self._choose_replacement(assignments)
         self.logger.info(
             f"replacement for {topic}-{partition}:{len(selected)}: {selected} -> {replacements}"
         )
         self.logger.info(
             f"new assignments for {topic}-{partition}: {assignments}")
 
-        admin.set_partition_replicas(topic, partition, assignments)
+        res = admin.set_partition_replicas(topic, partition, assignments)
+        assert res.status_code == 200, \
+                f"setting replicas for {topic}-{partition} failed: {res.text}"
+
+        # the target replica set is fixed for the duration of the polling below
+        target = self._assignment_set(assignments)
 
         def status_done():
             info = admin.get_partitions(topic, partition)
             self.logger.info(
                 f"current assignments for {topic}-{partition}: {info}")
-            converged = self._equal_assignments(info["replicas"], assignments)
+            converged = self._assignment_set(info["replicas"]) == target
             return converged and info["status"] == "done"
 
-        # wait until redpanda reports complete
-        wait_until(status_done, timeout_sec=30, backoff_sec=1)
+        # wait until redpanda reports complete. an unchanged replica set is
+        # still queued as an update and reported as in progress until the
+        # controller backend has processed it, so this applies to no-ops too.
+        self._wait_fast(status_done,
+                        timeout_sec=30,
+                        err_msg=f"{topic}-{partition} move did not complete")
+
+        # no replica moved, so there is no new placement to derive
+        if not selected and not replacements:
+            return
 
         def derived_done():
-            info = self._get_current_partitions(admin, topic, partition)
+            info = self._get_current_partitions(topic, partition)
             self.logger.info(
                 f"derived assignments for {topic}-{partition}: {info}")
-            return self._equal_assignments(info, assignments)
+            return self._assignment_set(info) == target
+
+        self._wait_fast(
+            derived_done,
+            timeout_sec=30,
+            err_msg=f"{topic}-{partition} replicas did not converge")
+
+    def _consume(self, topics, handle, timeout_sec=60):
+        """
+        Read every record in the given topics from the beginning, calling
+        handle on each message. Stops once the end offsets observed at the
+        start have been reached, or after timeout_sec.
+        """
+        consumer = KafkaConsumer(
+            *[spec.name for spec in topics],
+            bootstrap_servers=self.redpanda.brokers_list(),
+            group_id=None,
+            auto_offset_reset='earliest',
+            request_timeout_ms=5000,
+            fetch_max_bytes=5 * 1024 * 1024)
+        try:
+            # stop as soon as everything up to the end offsets has been read
+            # rather than waiting out an idle timeout.
+            end_offsets = consumer.end_offsets([
+                TopicPartition(spec.name, p) for spec in topics
+                for p in range(spec.partition_count)
+            ])
+            expected = sum(end_offsets.values())
+            self.logger.info(f"Expecting {expected} records")
+
+            count = 0
+            deadline = time.time() + timeout_sec
+            while count < expected:
+                if time.time() >= deadline:
+                    self.logger.warning(
+                        f"Timed out after {timeout_sec}s consuming from "
+                        f"{[str(s) for s in topics]}: read {count} of "
+                        f"{expected} records")
+                    break
+                batch = consumer.poll(timeout_ms=1000, max_records=10000)
+                for records in batch.values():
+                    for msg in records:
+                        handle(msg)
+                    count += len(records)
+        finally:
+            consumer.close()
+
+    def _log_record_diff(self, spec, produced, sample_size=10):
+        """
+        Re-read a topic whose digest did not match and log which records are
+        missing or unexpected.
+        """
+        produced = collections.Counter(produced)
+        consumed = collections.Counter()
+        self._consume([spec], lambda m: consumed.update([(m.key, m.value)]))
+        missing = produced - consumed
+        extra = consumed - produced
+        self.logger.error(
+            f"{spec}: produced {sum(produced.values())} records, consumed "
+            f"{sum(consumed.values())}, {sum(missing.values())} missing, "
+            f"{sum(extra.values())} extra")
+        self.logger.error(f"{spec}: sample of missing keys: "
+                          f"{[k for k, _ in list(missing)[:sample_size]]}")
+        self.logger.error(f"{spec}: sample of extra keys: "
+                          f"{[k for k, _ in list(extra)[:sample_size]]}")
 
-        wait_until(derived_done, timeout_sec=30, backoff_sec=1)
+    @staticmethod
+    def _make_topics():
+        return [
+            TopicSpec(name=f"topic{i}",
+                      partition_count=partition_count,
+                      replication_factor=3)
+            for i, partition_count in enumerate(range(1, 5))
+        ]
 
     @cluster(num_nodes=3)
     def test_empty(self):
         """
         Move empty partitions.
         """
-        topics = []
-        for partition_count in range(1, 5):
-            for replication_factor in (3, 3):
-                name = f"topic{len(topics)}"
-                spec = TopicSpec(name=name,
-                                 partition_count=partition_count,
-                                 replication_factor=replication_factor)
-                topics.append(spec)
-
-        for spec in topics:
-            self.redpanda.create_topic(spec)
-
-        for _ in range(25):
-            self._move_and_verify()
+        topics = self._make_topics()
+        self.redpanda.create_topics(topics)
+
+        metadata = self._describe_topics(topics)
+
+        # moves of different partitions touch independent raft groups, so they
+        # are run concurrently. a partition is never moved by two workers at
+        # the same time.
+        partitions = [(t["topic"], p["partition"]) for t in metadata
+                      for p in t["partitions"]]
+        assert self.MOVE_WORKERS < len(partitions)
+        lock = threading.Lock()
+        moving = set()
+
+        def claim():
+            with lock:
+                free = [tp for tp in partitions if tp not in moving]
+                tp = random.choice(free)
+                moving.add(tp)
+                return tp
+
+        def move(_):
+            topic, partition = claim()
+            try:
+                self._move_and_verify(metadata, topic, partition)
+            finally:
+                with lock:
+                    moving.remove((topic, partition))
+
+        with ThreadPoolExecutor(max_workers=self.MOVE_WORKERS) as executor:
+            list(executor.map(move, range(25)))
 
     @cluster(num_nodes=3)
     def test_static(self):
         """
         Move partitions with data, but no active producers or consumers.
         """
-        topics = []
-        for partition_count in range(1, 5):
-            for replication_factor in (3, 3):
-                name = f"topic{len(topics)}"
-                spec = TopicSpec(name=name,
-                                 partition_count=partition_count,
-                                 replication_factor=replication_factor)
-                topics.append(spec)
-
-        for spec in topics:
-            self.redpanda.create_topic(spec)
+        topics = self._make_topics()
+        self.redpanda.create_topics(topics)
 
         num_records = 1000
-        produced = set(((f"key-{i}".encode(), f"value-{i}".encode())
-                        for i in range(num_records)))
-
-        for spec in topics:
+        keys = [f"key-{i}".encode() for i in range(num_records)]
+        values = [f"value-{i}".encode() for i in range(num_records)]
+        produced = RecordDigest()
+        for record in zip(keys, values):
+            produced.add(record)
+
+        # records are assigned to partitions round-robin, which bypasses the
+        # client's key hashing partitioner.
+        producer = KafkaProducer(
+            batch_size=131072,
+            linger_ms=50,
+            acks=1,
+            bootstrap_servers=self.redpanda.brokers_list())
+
+        def produce(spec):
             self.logger.info(f"Producing to {spec}")
-            producer = KafkaProducer(
-                batch_size=4096,
-                bootstrap_servers=self.redpanda.brokers_list())
-            for key, value in produced:
-                producer.send(spec.name, key=key, value=value)
-            producer.flush()
-            self.logger.info(f"Finished producing to {spec}")
-
+            for i in range(num_records):
+                producer.send(spec.name,
+                              key=keys[i],
+                              value=values[i],
+                              partition=i % spec.partition_count)
+
+        # the producer is thread-safe and batches per topic-partition, so all
+        # topics are fed concurrently and flushed once.
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(produce, topics))
+        producer.flush()
+        producer.close()
+        self.logger.info(f"Finished producing to {len(topics)} topics")
+
+        metadata = self._describe_topics(topics)
         for _ in range(25):
-            self._move_and_verify()
-
-        for spec in topics:
-            self.logger.info(f"Verifying records in {spec}")
-            consumer = KafkaConsumer(
-                spec.name,
-                bootstrap_servers=self.redpanda.brokers_list(),
-                group_id=None,
-                auto_offset_reset='earliest',
-                request_timeout_ms=5000,
-                consumer_timeout_ms=10000)
-            consumed = []
-            for msg in consumer:
-                consumed.append((msg.key, msg.value))
-            self.logger.info(f"Finished verifying records in {spec}")
-            assert set(consumed) == produced
+            self._move_and_verify(metadata)
+
+        self.logger.info(f"Verifying records in {len(topics)} topics")
+        consumed = collections.defaultdict(RecordDigest)
+
+        def digest(msg):
+            consumed[msg.topic].add((msg.key, msg.value))
+
+        self._consume(topics, digest)
+
+        mismatched = [s for s in topics if consumed[s.name] != produced]
+        for spec in mismatched:
+            self._log_record_diff(spec, zip(keys, values))
+        assert not mismatched, \
+                f"records differ in topics: {[str(s) for s in mismatched]}"